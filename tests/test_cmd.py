@@ -1,6 +1,8 @@
 import pytest
 
-from wal_e.cmd import parse_boolean_envvar
+from wal_e import cmd
+from wal_e import exception
+from wal_e.cmd import external_program_check, parse_boolean_envvar
 
 
 @pytest.mark.parametrize('val,expected', [
@@ -15,3 +17,42 @@ from wal_e.cmd import parse_boolean_envvar
 ])
 def test_parse_boolean_envvar(val, expected):
     assert parse_boolean_envvar(val) == expected
+
+
+def test_external_program_check():
+    external_program_check(['true', 'cat'])
+
+    with pytest.raises(exception.UserException) as e:
+        external_program_check(['wal-e-missing-a', 'cat', 'wal-e-missing-b'])
+
+    assert e.value.detail.endswith('wal-e-missing-a, wal-e-missing-b')
+
+
+def test_external_program_check_locate_only(monkeypatch):
+    """Programs are looked up on the PATH without being run."""
+    def fail(*args, **kwargs):
+        raise AssertionError('should not run anything')
+
+    monkeypatch.setattr(cmd, 'popen_sp', fail)
+    external_program_check(['true', 'cat'], locate_only=True)
+
+    with pytest.raises(exception.UserException) as e:
+        external_program_check(['cat', 'wal-e-missing-a'], locate_only=True)
+
+    assert e.value.detail.endswith('programs, are they installed? '
+                                   'wal-e-missing-a')
+
+
+@pytest.mark.parametrize('option,dest', [
+    ('--pool-size', 'pool_size'),
+    ('--compression-pool-size', 'compression_pool_size'),
+])
+def test_backup_push_pool_size_at_least_one(option, dest):
+    """Pool sizes that could never run an upload are rejected."""
+    parser = cmd.build_parser()
+
+    args = parser.parse_args(['backup-push', '/pgdata', option, '1'])
+    assert getattr(args, dest) == 1
+
+    with pytest.raises(SystemExit):
+        parser.parse_args(['backup-push', '/pgdata', option, '0'])
@@ -49,3 +49,22 @@ def test_explicit_deletion_without_exception(tmpdir):
         open(p)
 
     assert e.value.errno == errno.ENOENT
+
+
+def test_fadvise(tmpdir, monkeypatch):
+    advised = []
+
+    def fake_fadvise(fd, offset, length, advice):
+        advised.append((offset, length, advice))
+
+    monkeypatch.setattr(os, 'posix_fadvise', fake_fadvise, raising=False)
+    monkeypatch.setattr(os, 'POSIX_FADV_DONTNEED', 4, raising=False)
+    monkeypatch.delattr(os, 'POSIX_FADV_NOREUSE', raising=False)
+
+    with open(str(tmpdir.join('somefile')), 'wb') as f:
+        files.fadvise(f.fileno(), 'POSIX_FADV_DONTNEED')
+
+        # Advice unknown to the platform is skipped.
+        files.fadvise(f.fileno(), 'POSIX_FADV_NOREUSE')
+
+    assert advised == [(0, 0, 4)]
@@ -0,0 +1,14 @@
+import pytest
+
+from wal_e import exception
+from wal_e.worker.pg import psql_worker
+
+
+def test_psql_csv_run_failure(monkeypatch):
+    """A failed query raises a UserException naming the query."""
+    monkeypatch.setattr(psql_worker, 'PSQL_BIN', 'false')
+
+    with pytest.raises(exception.UserException) as e:
+        psql_worker.psql_csv_run('SELECT 1')
+
+    assert e.value.detail == 'Query was "SELECT 1".'
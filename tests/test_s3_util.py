@@ -1,11 +1,16 @@
 import boto.exception
+import boto.s3.key
+import gevent
+import io
 import os
 import pytest
+import socket
 
 from wal_e.blobstore.s3 import (
     Credentials,
     calling_format,
     do_lzop_get,
+    s3_util,
     sigv4_check_apply,
     uri_get_file,
     uri_put_file,
@@ -96,3 +101,153 @@ def test_sigv4_only_region(tmpdir, monkeypatch):
         assert contents == results
 
     upload_download()
+
+
+def test_connection_reuse(monkeypatch):
+    monkeypatch.setenv('AWS_REGION', 'us-east-1')
+    monkeypatch.delenv('WALE_S3_ENDPOINT', raising=False)
+    creds = Credentials('foo', 'bar')
+
+    conn = s3_util._connect(creds, 'wal-e-test-reuse')
+    assert s3_util._connect(creds, 'wal-e-test-reuse') is conn
+    assert s3_util._connect(creds, 'wal-e-test-other') is not conn
+    assert s3_util._connect(Credentials('foo', 'bar'),
+                            'wal-e-test-reuse') is not conn
+
+    monkeypatch.setenv('AWS_REGION', 'eu-central-1')
+    assert s3_util._connect(creds, 'wal-e-test-reuse') is not conn
+
+
+class FakeMultiPartUpload(object):
+    def __init__(self):
+        self.parts = []
+        self.state = 'open'
+
+    def upload_part_from_file(self, fp, part_num):
+        self.parts.append((part_num, fp.read()))
+
+    def complete_upload(self):
+        self.state = 'complete'
+
+    def cancel_upload(self):
+        self.state = 'cancelled'
+
+
+class FakeBucket(object):
+    def __init__(self):
+        self.uploads = []
+
+    def initiate_multipart_upload(self, key_name, headers, encrypt_key):
+        mp = FakeMultiPartUpload()
+        self.uploads.append((key_name, headers, mp))
+        return mp
+
+
+def fake_uri_to_key(monkeypatch):
+    bucket = FakeBucket()
+
+    def uri_to_key(creds, uri, conn=None):
+        key = boto.s3.key.Key(name=uri)
+        key.bucket = bucket
+        return key
+
+    monkeypatch.setattr(s3_util, '_uri_to_key', uri_to_key)
+    return bucket
+
+
+def test_uri_put_stream(monkeypatch):
+    bucket = fake_uri_to_key(monkeypatch)
+    monkeypatch.setattr(s3_util, 'STREAM_PART_BYTES', 4)
+
+    k = s3_util.uri_put_stream(None, 's3://bucket/key',
+                               io.BytesIO(b'abcdefghij'),
+                               content_type='text/plain')
+    assert k.size == 10
+
+    (name, headers, mp), = bucket.uploads
+    assert headers['Content-Type'] == 'text/plain'
+    assert mp.state == 'complete'
+    assert sorted(mp.parts) == [(1, b'abcd'), (2, b'efgh'), (3, b'ij')]
+
+    # An empty stream is uploaded as one empty part.
+    k = s3_util.uri_put_stream(None, 's3://bucket/key', io.BytesIO())
+    assert k.size == 0
+    assert bucket.uploads[-1][2].parts == [(1, b'')]
+
+
+def test_uri_put_stream_retries(monkeypatch):
+    """Transient errors in any step of an upload are retried."""
+    bucket = fake_uri_to_key(monkeypatch)
+
+    # Don't back off in earnest between attempts.
+    sleep = gevent.sleep
+    monkeypatch.setattr(gevent, 'sleep', lambda seconds: sleep(0))
+
+    def fail_once(f):
+        calls = []
+
+        def wrapper(*args, **kwargs):
+            calls.append(None)
+            if len(calls) == 1:
+                raise socket.error('transient')
+            return f(*args, **kwargs)
+
+        return wrapper
+
+    initiate = bucket.initiate_multipart_upload
+    bucket.initiate_multipart_upload = fail_once(initiate)
+
+    complete = FakeMultiPartUpload.complete_upload
+    monkeypatch.setattr(FakeMultiPartUpload, 'complete_upload',
+                        fail_once(complete))
+
+    upload_part = FakeMultiPartUpload.upload_part_from_file
+    monkeypatch.setattr(FakeMultiPartUpload, 'upload_part_from_file',
+                        fail_once(upload_part))
+
+    k = s3_util.uri_put_stream(None, 's3://bucket/key', io.BytesIO(b'abc'))
+    assert k.size == 3
+
+    (name, headers, mp), = bucket.uploads
+    assert mp.state == 'complete'
+    assert mp.parts == [(1, b'abc')]
+
+
+def test_uri_put_stream_cancel(monkeypatch):
+    bucket = fake_uri_to_key(monkeypatch)
+
+    class Explosion(Exception):
+        pass
+
+    class BadStream(object):
+        def read(self, size):
+            raise Explosion()
+
+    with pytest.raises(Explosion):
+        s3_util.uri_put_stream(None, 's3://bucket/key', BadStream())
+
+    assert bucket.uploads[0][2].state == 'cancelled'
+
+
+def test_uri_put_stream_part_failure(monkeypatch):
+    bucket = fake_uri_to_key(monkeypatch)
+    monkeypatch.setattr(s3_util, 'STREAM_PART_BYTES', 4)
+
+    class Explosion(Exception):
+        pass
+
+    def upload_part_from_file(self, fp, part_num):
+        if part_num == 2:
+            raise Explosion()
+
+    monkeypatch.setattr(FakeMultiPartUpload, 'upload_part_from_file',
+                        upload_part_from_file)
+
+    stream = io.BytesIO(b'x' * 100)
+    with pytest.raises(Explosion):
+        s3_util.uri_put_stream(None, 's3://bucket/key', stream)
+
+    assert bucket.uploads[0][2].state == 'cancelled'
+
+    # The stream is not read to its end once a part has failed.
+    assert stream.tell() < 100
@@ -1,6 +1,9 @@
+import io
 import os
+import pytest
 import tarfile
 
+from wal_e import pipeline
 from wal_e import tar_partition
 
 
@@ -149,3 +152,211 @@ def test_creation_upper_dir(tmpdir, monkeypatch):
 
     # Make sure the test exercised cat_extraction.
     assert check.called
+
+
+def test_tarfile_write_roundtrip(tmpdir):
+    """Check partitions written by tarfile_write can be read by tarfile
+
+    The member data is written without tarfile.TarFile.addfile, so
+    make sure the headers, padding, and end-of-archive marker are all
+    where tarfile expects them, including for files that shrink or
+    grow after being partitioned.
+
+    """
+    adir = tmpdir.join('adir').ensure(dir=True)
+    adir.join('empty').write('')
+    adir.join('odd').write('x' * 513)
+    adir.join('big').write('y' * 70000)
+    shrinks = adir.join('shrinks')
+    shrinks.write('z' * 1000)
+    grows = adir.join('grows')
+    grows.write('g' * 10)
+
+    spec, parts = tar_partition.partition(adir.strpath)
+    parts = list(parts)
+
+    shrinks.write('z' * 10)
+    grows.write('g' * 1000)
+
+    buf = io.BytesIO()
+    for part in parts:
+        part.tarfile_write(buf)
+
+    buf.seek(0)
+    contents = {}
+    with tarfile.open(fileobj=buf, mode='r') as tar:
+        for member in tar:
+            if member.isfile():
+                contents[member.name] = tar.extractfile(member).read()
+
+    buf.seek(0)
+    with tarfile.open(fileobj=buf, mode='r') as tar:
+        # Every member is described by a single header block.
+        for member in tar:
+            if member.isfile():
+                assert member.offset_data - member.offset == 512
+
+    assert contents['empty'] == b''
+    assert contents['odd'] == b'x' * 513
+    assert contents['big'] == b'y' * 70000
+    assert contents['shrinks'] == b'z' * 10 + b'\0' * 990
+    assert contents['grows'] == b'g' * 10
+
+
+@pytest.mark.skipif("not hasattr(os, 'posix_fadvise')")
+def test_fadvise_partition_members(tmpdir, monkeypatch):
+    """Check member files are advised sequential, then dropped
+
+    Empty files are not opened at all, so go unadvised.
+
+    """
+    adir = tmpdir.join('adir').ensure(dir=True)
+    adir.join('afile').write('1234567890')
+    adir.join('empty').write('')
+
+    advised = []
+
+    def fake_fadvise(fd, offset, length, advice):
+        advised.append(advice)
+
+    monkeypatch.setattr(os, 'posix_fadvise', fake_fadvise)
+
+    spec, parts = tar_partition.partition(adir.strpath)
+    for part in parts:
+        part.tarfile_write(io.BytesIO())
+
+    assert advised == [os.POSIX_FADV_SEQUENTIAL, os.POSIX_FADV_DONTNEED]
+
+
+def test_tarfile_write_skips_unlinked(tmpdir):
+    """Files unlinked after partitioning are left out, even empty ones"""
+    adir = tmpdir.join('adir').ensure(dir=True)
+    adir.join('kept').write('')
+    adir.join('empty').write('')
+    adir.join('full').write('1234567890')
+
+    spec, parts = tar_partition.partition(adir.strpath)
+    parts = list(parts)
+
+    adir.join('empty').remove()
+    adir.join('full').remove()
+
+    buf = io.BytesIO()
+    for part in parts:
+        part.tarfile_write(buf)
+
+    buf.seek(0)
+    with tarfile.open(fileobj=buf, mode='r') as tar:
+        names = [member.name for member in tar if member.isfile()]
+
+    assert names == ['kept']
+
+
+@pytest.mark.skipif("not hasattr(os, 'sendfile')")
+def test_tarfile_write_sendfile(tmpdir, monkeypatch):
+    """Check member data written to a pipe is moved with sendfile"""
+    adir = tmpdir.join('adir').ensure(dir=True)
+    adir.join('big').write('y' * 70000)
+    shrinks = adir.join('shrinks')
+    shrinks.write('z' * 1000)
+
+    spec, parts = tar_partition.partition(adir.strpath)
+    parts = list(parts)
+    shrinks.write('z' * 10)
+
+    sent = []
+    real_sendfile = os.sendfile
+
+    def counting_sendfile(*args):
+        n = real_sendfile(*args)
+        sent.append(n)
+        return n
+
+    monkeypatch.setattr(os, 'sendfile', counting_sendfile)
+
+    tar_path = str(tmpdir.join('out.tar'))
+    with open(tar_path, 'wb') as f:
+        with pipeline.get_cat_pipeline(pipeline.PIPE, f) as pl:
+            for part in parts:
+                part.tarfile_write(pl.stdin)
+
+    assert sum(sent) == 70000 + 10
+
+    contents = {}
+    with tarfile.open(tar_path, mode='r') as tar:
+        for member in tar:
+            if member.isfile():
+                contents[member.name] = tar.extractfile(member).read()
+
+    assert contents['big'] == b'y' * 70000
+    assert contents['shrinks'] == b'z' * 10 + b'\0' * 990
+
+
+def test_format_manifest(tmpdir):
+    adir = tmpdir.join('adir').ensure(dir=True)
+    adir.join('afile').write('1234567890')
+
+    spec, parts = tar_partition.partition(adir.strpath)
+    lines = '\n'.join(part.format_manifest() for part in parts).split('\n')
+
+    # The cluster directory itself is the member with the empty name.
+    assert lines == ['\t0', 'afile\t10']
+
+
+def test_stream_pad_file_obj():
+    f = tar_partition.StreamPadFileObj(io.BytesIO(b'abc'), 10)
+    assert f.read(2) == b'ab'
+    assert f.read(4) == b'c\0\0\0'
+    assert f.read(2) == b'\0\0'
+    assert f.read(4) == b'\0\0'
+    assert f.read(4) == b''
+
+    # Padding blocks of a common size are not allocated anew.
+    f = tar_partition.StreamPadFileObj(io.BytesIO(b''), 12)
+    assert f.read(4) is f.read(4)
+
+
+def test_tarinfo_factory_matches_gettarinfo(tmpdir):
+    """Check TarInfo values built from lstat match tarfile's own"""
+    adir = tmpdir.join('adir').ensure(dir=True)
+    adir.join('afile').write('1234567890')
+    adir.join('adir2').ensure(dir=True)
+    os.symlink('afile', adir.join('alink').strpath)
+    os.link(adir.join('afile').strpath, adir.join('ahardlink').strpath)
+    os.mkfifo(adir.join('afifo').strpath)
+
+    root = adir.strpath + os.path.sep
+    names = ['', 'afile', 'adir2', 'alink', 'ahardlink', 'afifo']
+
+    factory = tar_partition._TarInfoFactory()
+    with tarfile.TarFile(os.devnull, 'w', dereference=False) as tar:
+        for name in names:
+            path = root + name
+            expected = tar.gettarinfo(path, arcname=name)
+            actual = factory(path, name, os.lstat(path))
+            assert actual.tobuf() == expected.tobuf()
+
+
+def test_partition_tablespace(tmpdir):
+    """Check tablespaces are walked through their pg_tblspc symlinks"""
+    ts = tmpdir.join('ts').ensure(dir=True)
+    ts.join('PG_9.6', '1', 'afile').write('abc', ensure=True)
+    ts.join('PG_9.6', 'pgsql_tmp', 'junk').write('xyz', ensure=True)
+    ts.join('PG_9.6', 'empty').ensure(dir=True)
+
+    adir = tmpdir.join('adir').ensure(dir=True)
+    adir.join('pg_tblspc').ensure(dir=True)
+    adir.join('pg_tblspc', '16384').mksymlinkto(ts)
+
+    spec, parts = tar_partition.partition(adir.strpath)
+    names = sorted(member.tarinfo.name for part in parts for member in part)
+
+    assert spec['tablespaces'] == ['16384']
+    assert spec['16384'] == {'loc': ts.strpath + os.path.sep,
+                             'link': 'pg_tblspc/16384'}
+    assert names == ['',
+                     'pg_tblspc',
+                     'pg_tblspc/16384/PG_9.6',
+                     'pg_tblspc/16384/PG_9.6/1/afile',
+                     'pg_tblspc/16384/PG_9.6/empty',
+                     'pg_tblspc/16384/PG_9.6/pgsql_tmp']
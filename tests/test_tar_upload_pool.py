@@ -1,3 +1,4 @@
+import gevent
 import pytest
 
 from wal_e import exception
@@ -139,3 +140,137 @@ def test_pool_concurrent_failure():
         pool.join()
 
     assert e.value is exc
+
+
+def test_partition_uploader_stage_limits(monkeypatch):
+    """Compression and upload concurrency are limited separately."""
+    active = {'compress': 0, 'upload': 0}
+    peak = dict(active)
+
+    def stage(name, duration):
+        def run(self, tpart, tf):
+            active[name] += 1
+            peak[name] = max(peak[name], active[name])
+            gevent.sleep(duration)
+            active[name] -= 1
+
+        return run
+
+    monkeypatch.setattr(worker.PartitionUploader, '_compress',
+                        stage('compress', 0.01))
+    monkeypatch.setattr(worker.PartitionUploader, '_upload',
+                        stage('upload', 0.05))
+
+    uploader = worker.PartitionUploader(
+        None, 'file://localhost/tmp/wal-e-test', None, None,
+        compression_concurrency=1, upload_concurrency=3)
+    pool = worker.TarUploadPool(uploader, 4)
+
+    for i in range(8):
+        pool.put(FakeTarPartition(1))
+
+    pool.join()
+
+    assert peak == {'compress': 1, 'upload': 3}
+
+
+def test_pool_failure_stops_uploads():
+    """A failed upload stops the others rather than leaving them running."""
+    stopped = []
+
+    class SlowUploader(object):
+        def __call__(self, tpart):
+            if tpart._explosive:
+                raise tpart._explosive
+
+            try:
+                gevent.sleep(5)
+            except gevent.GreenletExit:
+                stopped.append(tpart)
+                raise
+
+            return tpart
+
+    slow = FakeTarPartition(1)
+    pool = worker.TarUploadPool(SlowUploader(), 4, 4)
+    pool.put(slow)
+    pool.put(FakeTarPartition(1, explosive=Explosion('boom')))
+
+    with pytest.raises(Explosion):
+        pool.join()
+
+    assert stopped == [slow]
+
+
+def test_pool_kill():
+    """Killing the pool stops uploads in progress and accepts no more."""
+    stopped = []
+
+    def slow_uploader(tpart):
+        try:
+            gevent.sleep(5)
+        except gevent.GreenletExit:
+            stopped.append(tpart)
+            raise
+
+    slow = FakeTarPartition(1)
+    pool = worker.TarUploadPool(slow_uploader, 4, 4)
+    pool.put(slow)
+    gevent.sleep(0)
+
+    pool.kill()
+    assert stopped == [slow]
+
+    with pytest.raises(exception.UserCritical):
+        pool.put(FakeTarPartition(1))
+
+
+class FakeStreamBlobstore(object):
+    """Accepts uploads of unknown length, recording them."""
+    def __init__(self):
+        self.uploads = {}
+
+    def uri_put_stream(self, creds, uri, stream):
+        data = stream.read()
+        self.uploads[uri] = data
+
+        class Key(object):
+            size = len(data)
+
+        return Key()
+
+
+class StreamedTarPartition(FakeTarPartition):
+    name = 7
+
+    def tarfile_write(self, fileobj):
+        if self._explosive:
+            raise self._explosive
+
+        fileobj.write(b'x' * 100000)
+
+
+def test_partition_uploader_stream():
+    """Partitions are streamed to stores that accept unsized uploads."""
+    uploader = worker.PartitionUploader(
+        None, 'file://localhost/tmp/wal-e-test', None, None)
+    uploader.blobstore = FakeStreamBlobstore()
+
+    uploader(StreamedTarPartition(1))
+
+    url = ('file://localhost/tmp/wal-e-test/'
+           'tar_partitions/part_00000007.tar.lzo')
+    assert list(uploader.blobstore.uploads) == [url]
+    assert uploader.blobstore.uploads[url]
+
+
+def test_partition_uploader_stream_failure():
+    """A failure to build the partition stops its upload."""
+    uploader = worker.PartitionUploader(
+        None, 'file://localhost/tmp/wal-e-test', None, None)
+    uploader.blobstore = FakeStreamBlobstore()
+
+    with pytest.raises(Explosion):
+        uploader(StreamedTarPartition(1, explosive=Explosion('boom')))
+
+    assert uploader.blobstore.uploads == {}
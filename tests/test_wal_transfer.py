@@ -2,6 +2,7 @@ import gevent
 import pytest
 
 from fast_wait import fast_wait
+from wal_e import storage
 from wal_e import worker
 from wal_e.exception import UserCritical
 
@@ -242,3 +243,14 @@ def test_mark_done_fault():
         group.join()
 
     assert e.value is exp
+
+
+def test_wal_uploader_spool_budget():
+    """Concurrent WAL uploads share a fixed memory budget for spooling."""
+    layout = storage.StorageLayout('file://localhost/tmp/wal-e-test')
+
+    alone = worker.WalUploader(layout, None, None)
+    assert alone.spool_bytes == 16 * 1024 * 1024
+
+    pooled = worker.WalUploader(layout, None, None, concurrency=32)
+    assert pooled.spool_bytes == 2 * 1024 * 1024
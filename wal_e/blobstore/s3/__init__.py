@@ -13,6 +13,7 @@ from wal_e.blobstore.s3.s3_util import do_lzop_get
 from wal_e.blobstore.s3.s3_util import sigv4_check_apply
 from wal_e.blobstore.s3.s3_util import uri_get_file
 from wal_e.blobstore.s3.s3_util import uri_put_file
+from wal_e.blobstore.s3.s3_util import uri_put_stream
 from wal_e.blobstore.s3.s3_util import write_and_return_error
 
 __all__ = [
@@ -21,6 +22,7 @@ __all__ = [
     'do_lzop_get',
     'sigv4_check_apply',
     'uri_put_file',
+    'uri_put_stream',
     'uri_get_file',
     'write_and_return_error',
 ]
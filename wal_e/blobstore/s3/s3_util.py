@@ -1,7 +1,10 @@
+from io import BytesIO
 from urllib.parse import urlparse
 import gevent
+import gevent.pool
 import os
 import socket
+import sys
 import traceback
 
 import boto
@@ -12,7 +15,8 @@ from wal_e import log_help
 from wal_e.exception import UserException
 from wal_e.pipeline import get_download_pipeline
 from wal_e.piper import PIPE
-from wal_e.retries import retry, retry_with_count
+from wal_e.retries import (log_send_failures_on_error, retry,
+                           retry_with_count)
 
 logger = log_help.WalELogger(__name__)
 
@@ -27,13 +31,42 @@ if not boto.config.has_option('Boto', 'http_socket_timeout'):
     boto.config.set('Boto', 'http_socket_timeout', '5')
 
 
+# Connections are kept for the life of the process so that boto's
+# pool of HTTP connections, and thereby TLS sessions, are re-used by
+# every upload and download against the same bucket rather than being
+# set up afresh for each key.  The environment variables that steer
+# connection set-up are part of the key so that changes are honored.
+_connections = {}
+
+
+def _connect(creds, bucket_name):
+    cache_key = (creds, bucket_name,
+                 os.getenv('AWS_REGION'), os.getenv('WALE_S3_ENDPOINT'))
+    conn = _connections.get(cache_key)
+
+    if conn is None:
+        cinfo = calling_format.from_store_name(bucket_name)
+        conn = cinfo.connect(creds)
+        _connections[cache_key] = conn
+
+    return conn
+
+
+# Size of the parts of streams uploaded by uri_put_stream.  S3 allows
+# at most 10000 parts to an upload, putting the limit on the size of a
+# stream at 156 GiB, far more than any tar partition.
+STREAM_PART_BYTES = 16 * 1024 * 1024
+
+# Number of parts of a stream that uri_put_stream sends concurrently.
+STREAM_PART_CONCURRENCY = 4
+
+
 def _uri_to_key(creds, uri, conn=None):
     assert uri.startswith('s3://')
     url_tup = urlparse(uri)
     bucket_name = url_tup.netloc
-    cinfo = calling_format.from_store_name(bucket_name)
     if conn is None:
-        conn = cinfo.connect(creds)
+        conn = _connect(creds, bucket_name)
     bucket = boto.s3.bucket.Bucket(connection=conn, name=bucket_name)
     return boto.s3.key.Key(bucket=bucket, name=url_tup.path)
 
@@ -60,6 +93,105 @@ def uri_put_file(creds, uri, fp, content_type=None, conn=None):
     return k
 
 
+def uri_put_stream(creds, uri, stream, content_type=None, conn=None):
+    """Upload the contents of a stream of unknown length
+
+    The stream is read in parts of STREAM_PART_BYTES that are sent as
+    a multipart upload, so its contents need not be staged anywhere
+    to learn their size first.  Should sending a part fail with a
+    transient error, only that part is sent again.
+
+    """
+    k = _uri_to_key(creds, uri, conn=conn)
+
+    storage_class = os.getenv('WALE_S3_STORAGE_CLASS', 'STANDARD')
+    headers = {"x-amz-storage-class": storage_class}
+    if content_type is not None:
+        headers['Content-Type'] = content_type
+
+    # Starting and completing the upload are retried like each of
+    # its parts, so a transient error in any of them does not fail the
+    # whole stream.
+    @retry(retry_with_count(log_send_failures_on_error(
+        'start the upload of ' + uri)))
+    def initiate():
+        return k.bucket.initiate_multipart_upload(
+            k.name, headers=headers, encrypt_key=True)
+
+    part_failure = log_send_failures_on_error('send a part of ' + uri)
+
+    @retry(retry_with_count(part_failure))
+    def resend_part(part, part_num):
+        mp.upload_part_from_file(BytesIO(part), part_num)
+
+    def put_part(part, part_num):
+        # Make the first attempt at each part directly: retry naps
+        # before every attempt, which would add up over the hundred or
+        # so parts of a partition.  Only a failure worth retrying is
+        # handed over to be retried.
+        try:
+            mp.upload_part_from_file(BytesIO(part), part_num)
+        except Exception:
+            part_failure(sys.exc_info(), 1)
+            resend_part(part, part_num)
+
+    @retry(retry_with_count(log_send_failures_on_error(
+        'complete the upload of ' + uri)))
+    def complete():
+        mp.complete_upload()
+
+    mp = initiate()
+
+    size = 0
+    part_num = 0
+
+    # Send several parts at once, so that reading the stream and the
+    # round trips of each part overlap.  Spawning into a full pool
+    # blocks, which keeps at most STREAM_PART_CONCURRENCY parts (and
+    # one more being read) in memory.
+    pool = gevent.pool.Pool(STREAM_PART_CONCURRENCY)
+    failed = []
+
+    try:
+        while not failed:
+            part = stream.read(STREAM_PART_BYTES)
+
+            # An empty stream still needs one (empty) part to
+            # complete the upload.
+            if not part and part_num > 0:
+                break
+
+            part_num += 1
+            g = pool.spawn(put_part, part, part_num)
+            g.link_exception(failed.append)
+            size += len(part)
+
+        pool.join(raise_error=True)
+
+        # Raise errors from parts that had failed before the join.
+        for g in failed:
+            g.get()
+
+        complete()
+    except BaseException:
+        pool.kill()
+
+        # Don't leave the parts sent so far to be stored (and billed)
+        # indefinitely.  A failure to clean up is secondary to
+        # whatever went wrong in the first place.
+        try:
+            mp.cancel_upload()
+        except Exception:
+            logger.warning(
+                msg='could not cancel failed multipart upload',
+                detail='The upload to {url} was left incomplete.'
+                .format(url=uri))
+        raise
+
+    k.size = size
+    return k
+
+
 def uri_get_file(creds, uri, conn=None):
     k = _uri_to_key(creds, uri, conn=conn)
     return k.get_contents_as_string()
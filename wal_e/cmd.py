@@ -60,9 +60,11 @@ def ssl_monkey():
 
 
 import argparse
+import gevent
 import logging
 import os
 import re
+import shutil
 import subprocess
 import textwrap
 import traceback
@@ -72,7 +74,7 @@ from wal_e import log_help
 from wal_e.exception import UserCritical
 from wal_e.exception import UserException
 from wal_e import storage
-from wal_e.piper import popen_sp
+from wal_e.piper import popen_sp, popen_wait
 from wal_e.worker.pg import PSQL_BIN, psql_csv_run
 from wal_e.pipeline import LZOP_BIN, PV_BIN, GPG_BIN
 from wal_e.worker.pg import CONFIG_BIN, PgControlDataParser
@@ -82,9 +84,12 @@ log_help.configure(
 
 logger = log_help.WalELogger('wal_e.main')
 
+# Subcommands run by Postgres for every WAL segment.
+WAL_SUBCOMMANDS = ('wal-prefetch', 'wal-push', 'wal-fetch')
+
 
 def external_program_check(
-    to_check=frozenset([PSQL_BIN, LZOP_BIN, PV_BIN])):
+    to_check=frozenset([PSQL_BIN, LZOP_BIN, PV_BIN]), locate_only=False):
     """
     Validates the existence and basic working-ness of other programs
 
@@ -95,6 +100,10 @@ def external_program_check(
     saving measure.  This problem has confused The Author in practice
     when switching rapidly between machines.
 
+    With locate_only, programs are only looked up on the PATH rather
+    than run, for the WAL subcommands: Postgres runs those once per
+    segment, where a process start per program adds up.
+
     """
 
     could_not_run = []
@@ -110,28 +119,40 @@ def external_program_check(
         raise EnvironmentError('INTERNAL: Had problems running psql '
                                'from external_program_check')
 
-    with open(os.devnull, 'wb') as nullf:
-        for program in to_check:
-            try:
-                if program is PSQL_BIN:
-                    psql_csv_run('SELECT 1', error_handler=psql_err_handler)
+    def check(program):
+        try:
+            if program is PSQL_BIN:
+                psql_csv_run('SELECT 1', error_handler=psql_err_handler)
+            elif locate_only:
+                return shutil.which(program) is not None
+            else:
+                if program is PV_BIN:
+                    extra_args = ['--quiet']
                 else:
-                    if program is PV_BIN:
-                        extra_args = ['--quiet']
-                    else:
-                        extra_args = []
-
-                    proc = popen_sp([program] + extra_args,
-                                    stdout=nullf, stderr=nullf,
-                                    stdin=subprocess.PIPE)
-
-                    # Close stdin for processes that default to
-                    # reading from the pipe; the programs WAL-E uses
-                    # of this kind will terminate in this case.
-                    proc.stdin.close()
-                    proc.wait()
-            except EnvironmentError:
-                could_not_run.append(program)
+                    extra_args = []
+
+                # Give an empty stdin to processes that default to
+                # reading from it; the programs WAL-E uses of this
+                # kind will terminate in this case.
+                proc = popen_sp([program] + extra_args,
+                                stdout=subprocess.DEVNULL,
+                                stderr=subprocess.DEVNULL,
+                                stdin=subprocess.DEVNULL)
+                popen_wait(proc)
+        except EnvironmentError:
+            return False
+
+        return True
+
+    # Run the checks concurrently: psql in particular has to connect
+    # to the database, which is slow next to starting the others.
+    to_check = list(to_check)
+    checks = [gevent.spawn(check, program) for program in to_check]
+    gevent.joinall(checks, raise_error=True)
+
+    for program, g in zip(to_check, checks):
+        if not g.value:
+            could_not_run.append(program)
 
     if could_not_run:
         error_msgs.append(
@@ -168,6 +189,15 @@ def parse_boolean_envvar(val):
         raise ValueError('Invalid boolean environment variable: %s' % val)
 
 
+def positive_int(val):
+    """Parse a command line option that must be at least one."""
+    num = int(val)
+    if num < 1:
+        raise argparse.ArgumentTypeError(
+            'must be at least 1, not {0}'.format(num))
+    return num
+
+
 def build_parser():
     parser = argparse.ArgumentParser(
         formatter_class=argparse.RawDescriptionHelpFormatter,
@@ -238,7 +268,7 @@ def build_parser():
                                          help="Postgres cluster path, "
                                          "such as '/var/lib/database'")
     backup_fetchpush_parent.add_argument(
-        '--pool-size', '-p', type=int, default=4,
+        '--pool-size', '-p', type=positive_int, default=4,
         help='Set the maximum number of concurrent transfers')
 
     # operator to print the wal-e version
@@ -271,6 +301,10 @@ def build_parser():
         'tunable number of bytes per second', dest='rate_limit',
         metavar='BYTES_PER_SECOND',
         type=int, default=None)
+    backup_push_parser.add_argument(
+        '--compression-pool-size', type=positive_int, default=None,
+        help='Set the maximum number of concurrent compressions, '
+        'defaulting to the value of --pool-size')
     backup_push_parser.add_argument(
         '--while-offline',
         help=('Backup a Postgres cluster that is in a stopped state '
@@ -479,7 +513,8 @@ def configure_backup_cxt(args):
     # code path suffices.
     gpg_key_id = args.gpg_key_id or os.getenv('WALE_GPG_KEY_ID')
     if gpg_key_id is not None:
-        external_program_check([GPG_BIN])
+        external_program_check(
+            [GPG_BIN], locate_only=args.subcommand in WAL_SUBCOMMANDS)
 
     # Enumeration of reading in configuration for all supported
     # backend data stores, yielding value adhering to the
@@ -572,7 +607,7 @@ def render_subcommand(args):
     if args.subcommand == 'delete':
         return 'delete ' + args.delete_subcommand
 
-    if args.subcommand in ('wal-prefetch', 'wal-push', 'wal-fetch'):
+    if args.subcommand in WAL_SUBCOMMANDS:
         return None
 
     return args.subcommand
@@ -643,19 +678,20 @@ def main():
                 args.PG_CLUSTER_DIRECTORY,
                 rate_limit=rate_limit,
                 while_offline=while_offline,
-                pool_size=args.pool_size)
+                pool_size=args.pool_size,
+                compression_pool_size=args.compression_pool_size)
         elif subcommand == 'wal-fetch':
-            external_program_check([LZOP_BIN])
+            external_program_check([LZOP_BIN], locate_only=True)
             res = backup_cxt.wal_restore(args.WAL_SEGMENT,
                                          args.WAL_DESTINATION,
                                          args.prefetch)
             if not res:
                 sys.exit(1)
         elif subcommand == 'wal-prefetch':
-            external_program_check([LZOP_BIN])
+            external_program_check([LZOP_BIN], locate_only=True)
             backup_cxt.wal_prefetch(args.BASE_DIRECTORY, args.SEGMENT)
         elif subcommand == 'wal-push':
-            external_program_check([LZOP_BIN])
+            external_program_check([LZOP_BIN], locate_only=True)
             backup_cxt.wal_archive(args.WAL_SEGMENT,
                                    concurrency=args.pool_size)
         elif subcommand == 'delete':
@@ -22,3 +22,15 @@ class DeleteOnError(object):
         finally:
             if self.f:
                 self.f.close()
+
+
+def fadvise(fd, advice_name):
+    """Advise the kernel about the use of an entire file, if supported
+
+    The advice is named as in the os module, e.g. 'POSIX_FADV_DONTNEED',
+    and is silently skipped on platforms lacking posix_fadvise.
+
+    """
+    advice = getattr(os, advice_name, None)
+    if advice is not None:
+        os.posix_fadvise(fd, 0, 0, advice)
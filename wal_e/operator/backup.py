@@ -259,7 +259,8 @@ class Backup(object):
         # in archive_status.
         xlog_dir = os.path.dirname(wal_path)
         segment = WalSegment(wal_path, explicit=True)
-        uploader = WalUploader(self.layout, self.creds, self.gpg_key_id)
+        uploader = WalUploader(self.layout, self.creds, self.gpg_key_id,
+                               concurrency=concurrency)
         group = WalTransferGroup(uploader)
         group.start(segment)
 
@@ -428,32 +429,37 @@ class Backup(object):
         return bl
 
     def _upload_pg_cluster_dir(self, start_backup_info, pg_cluster_dir,
-                               version, pool_size, rate_limit=None):
+                               version, pool_size, rate_limit=None,
+                               compression_pool_size=None):
         """
         Upload to url_prefix from pg_cluster_dir
 
         This function ignores the directory pg_xlog, which contains WAL
         files and are not generally part of a base backup.
 
-        Note that this is also lzo compresses the files: thus, the number
-        of pooled processes involves doing a full sequential scan of the
-        uncompressed Postgres heap file that is pipelined into lzo. Once
-        lzo is completely finished (necessary to have access to the file
-        size) the file is sent to S3 or WABS.
-
-        TODO: Investigate an optimization to decouple the compression and
-        upload steps to make sure that the most efficient possible use of
-        pipelining of network and disk resources occurs.  Right now it
-        possible to bounce back and forth between bottlenecking on reading
-        from the database block device and subsequently the S3/WABS sending
-        steps should the processes be at the same stage of the upload
-        pipeline: this can have a very negative impact on being able to
-        make full use of system resources.
-
-        Furthermore, it desirable to overflowing the page cache: having
-        separate tunables for number of simultanious compression jobs
-        (which occupy /tmp space and page cache) and number of uploads
-        (which affect upload throughput) would help.
+        Note that this is also lzo compresses the files: thus, each
+        partition involves doing a full sequential scan of the
+        uncompressed Postgres heap files that is pipelined into lzo.
+        For S3, lzo's output is streamed straight into a multipart
+        upload as it is produced.  Other storage services need the
+        object size up-front, so there lzo's output is written to a
+        temporary file and only sent once lzo is completely finished.
+
+        Compression and upload are limited separately: at most
+        compression_pool_size partitions are compressed at once and at
+        most pool_size are uploaded at once, so that a partition that
+        is ready to upload waits on the network rather than keeping
+        another partition from being read from the database block
+        device.  compression_pool_size defaults to pool_size.
+
+        Where a temporary file is used, it occupies /tmp space from
+        the start of the partition's compression until its upload
+        finishes.  So that this footprint does not grow with the
+        separate limits, no more than the greater of pool_size and
+        compression_pool_size partitions are in flight in total.  A
+        partition streamed to S3 is compressed and uploaded at the same
+        time, so it holds both limits at once: there, the lesser of the
+        two bounds how many partitions are in flight.
 
         """
         spec, parts = tar_partition.partition(pg_cluster_dir)
@@ -463,10 +469,13 @@ class Backup(object):
             .format(self.layout.prefix.rstrip('/'), FILE_STRUCTURE_VERSION,
                         **start_backup_info)
 
+        if compression_pool_size is None:
+            compression_pool_size = pool_size
+
         if rate_limit is None:
             per_process_limit = None
         else:
-            per_process_limit = int(rate_limit / pool_size)
+            per_process_limit = int(rate_limit / compression_pool_size)
 
         # Reject tiny per-process rate limits.  They should be
         # rejected more nicely elsewhere.
@@ -486,18 +495,27 @@ class Backup(object):
 
         logger.info(msg='postgres version metadata upload complete')
 
-        uploader = PartitionUploader(self.creds, backup_prefix,
-                                     per_process_limit, self.gpg_key_id)
-
-        pool = TarUploadPool(uploader, pool_size)
+        uploader = PartitionUploader(
+            self.creds, backup_prefix, per_process_limit, self.gpg_key_id,
+            compression_concurrency=compression_pool_size,
+            upload_concurrency=pool_size)
 
-        # Enqueue uploads for parallel execution
-        for tpart in parts:
-            total_size += tpart.total_member_size
+        pool = TarUploadPool(uploader, max(pool_size, compression_pool_size))
 
-            # 'put' can raise an exception for a just-failed upload,
-            # aborting the process.
-            pool.put(tpart)
+        try:
+            # Enqueue uploads for parallel execution
+            for tpart in parts:
+                total_size += tpart.total_member_size
+
+                # 'put' can raise an exception for a just-failed upload,
+                # aborting the process.
+                pool.put(tpart)
+        except BaseException:
+            # The cluster directory is walked as partitions are
+            # enqueued, so the walk can fail while uploads are in
+            # flight: do not leave them running.
+            pool.kill()
+            raise
 
         # Wait for remaining parts to upload.  An exception can be
         # raised to signal failure of the upload.
@@ -222,6 +222,9 @@ class NonBlockBufferedWriter(object):
         self._fd = fp.fileno()
         self._bd = ByteDeque()
 
+        # Count of bytes submitted, for .tell().
+        self._pos = 0
+
         _setup_fd(self._fd)
 
     def _partial_flush(self, max_retain):
@@ -248,6 +251,7 @@ class NonBlockBufferedWriter(object):
 
     def write(self, data):
         self._bd.add(data)
+        self._pos += len(data)
 
         flushed = True
         while flushed and self._bd.byteSz > PIPE_BUF_BYTES:
@@ -263,6 +267,47 @@ class NonBlockBufferedWriter(object):
         while self._bd.byteSz > 0:
             self._partial_flush(0)
 
+    def sendfile(self, in_fd, offset, count):
+        """Send up to count bytes of in_fd, starting at offset, to the pipe
+
+        Buffered bytes are flushed first, and then the kernel moves
+        the data via sendfile(2) without it being copied through
+        Python.
+
+        Returns the number of bytes sent.  That is fewer than count if
+        in_fd runs out of bytes or cannot be sent from at all (such as
+        on platforms without sendfile), leaving the remainder for the
+        caller to copy some other way.
+        """
+        self.flush()
+
+        if not hasattr(os, 'sendfile'):
+            return 0
+
+        sent = 0
+        while sent < count:
+            try:
+                n = os.sendfile(self._fd, in_fd, offset + sent, count - sent)
+            except EnvironmentError as e:
+                if e.errno in [errno.EAGAIN, errno.EWOULDBLOCK]:
+                    gevent.socket.wait_write(self._fd)
+                    continue
+                elif e.errno in [errno.EINVAL, errno.ENOSYS]:
+                    break
+                else:
+                    raise
+
+            if n == 0:
+                break
+
+            sent += n
+
+        self._pos += sent
+        return sent
+
+    def tell(self):
+        return self._pos
+
     def fileno(self):
         return self._fd
 
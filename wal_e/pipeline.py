@@ -2,11 +2,10 @@
 compression/encryption.
 """
 
-from gevent import sleep
 from wal_e import pipebuf
 
 from wal_e.exception import UserCritical
-from wal_e.piper import popen_sp, PIPE
+from wal_e.piper import popen_sp, popen_wait, PIPE
 
 PV_BIN = 'pv'
 GPG_BIN = 'gpg'
@@ -186,13 +185,7 @@ class PipelineCommand(object):
             return self._process.returncode
 
     def wait(self):
-        while True:
-            if self._process.poll() is not None:
-                break
-            else:
-                sleep(0.1)
-
-        return self._process.wait()
+        return popen_wait(self._process)
 
     def finish(self):
         retcode = self.wait()
@@ -70,6 +70,23 @@ class PopenShim(object):
 popen_sp = PopenShim()
 
 
+def popen_wait(proc):
+    """Wait for a process to exit without blocking other greenlets
+
+    Polls, since waiting on the process would block every greenlet.
+    Most processes exit soon after their input ends, so begin with
+    short naps, backing off so longer waits don't busy the event loop.
+
+    """
+    delay = 0.001
+
+    while proc.poll() is None:
+        gevent.sleep(delay)
+        delay = min(delay * 2, 0.1)
+
+    return proc.wait()
+
+
 def popen_nonblock(*args, **kwargs):
     """
     Create a process in the same way as popen_sp, but patch the file
@@ -1,11 +1,17 @@
 import functools
 import os
+import socket
 import sys
 import random
 import traceback
 
 import gevent
 
+try:
+    import boto.exception
+except ImportError:
+    boto = None
+
 from wal_e import exception
 from wal_e import log_help
 
@@ -141,3 +147,59 @@ def retry_with_count(side_effect_func):
         return increment_context(exc_processor_cxt)
 
     return retry_with_count_internal
+
+
+def is_s3_response_error(typ, value):
+    if boto is None:
+        return False
+
+    if not issubclass(typ, boto.exception.S3ResponseError):
+        return False
+
+    if not value.error_code == 'RequestTimeTooSkewed':
+        return False
+
+    return True
+
+
+def log_send_failures_on_error(action):
+    """
+    Make a side effect function for retry_with_count for sending data
+
+    Socket errors and S3 request time skew are logged and retried, and
+    any other exception is raised.
+
+    :param action: What was being attempted, for log messages, such
+                   as 'send the volume 3'.
+    :type action: string
+
+    """
+    def log_send_failures_on_error_internal(exc_tup, exc_processor_cxt):
+        def standard_detail_message(prefix=''):
+            return (prefix +
+                    '  There have been {n} attempts to {action} so far.'
+                    .format(n=exc_processor_cxt, action=action))
+
+        typ, value, tb = exc_tup
+        del exc_tup
+
+        # Screen for certain kinds of known-errors to retry from
+        if issubclass(typ, socket.error):
+            socketmsg = value[1] if isinstance(value, tuple) else value
+
+            logger.info(
+                msg='Retrying send because of a socket error',
+                detail=standard_detail_message(
+                    "The socket error's message is '{0}'."
+                    .format(socketmsg)))
+        elif is_s3_response_error(typ, value):
+            logger.info(
+                msg='Retrying send because of a Request Skew time',
+                detail=standard_detail_message())
+        else:
+            # This type of error is unrecognized as a retry-able
+            # condition, so propagate it, original stacktrace and
+            # all.
+            raise typ(value).with_traceback(tb)
+
+    return log_send_failures_on_error_internal
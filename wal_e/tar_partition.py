@@ -42,7 +42,10 @@ process considerably more complicated.
 """
 import collections
 import errno
+import gevent.threadpool
+import itertools
 import os
+import stat
 import tarfile
 import sys
 
@@ -53,6 +56,12 @@ from wal_e import pipebuf
 from wal_e import pipeline
 from wal_e.exception import UserException
 
+try:
+    import grp
+    import pwd
+except ImportError:
+    grp = pwd = None
+
 logger = log_help.WalELogger(__name__)
 
 PG_CONF = ('postgresql.conf',
@@ -63,6 +72,25 @@ PG_CONF = ('postgresql.conf',
            'promote')
 
 
+_zero_block = b''
+
+
+def _zeros(size):
+    """Return size NUL bytes
+
+    Padding a truncated file is done in a series of same-sized reads,
+    so the most recent block is kept and reused rather than allocating
+    another each time.
+
+    """
+    global _zero_block
+
+    if len(_zero_block) != size:
+        _zero_block = bytes(size)
+
+    return _zero_block
+
+
 class StreamPadFileObj(object):
     """
     Layer on a file to provide a precise stream byte length
@@ -90,7 +118,19 @@ class StreamPadFileObj(object):
         ret = self.underlying_fp.read(max_readable)
         lenret = len(ret)
         self.pos += lenret
-        return ret + b'\0' * (max_readable - lenret)
+
+        if lenret == max_readable:
+            return ret
+
+        # The underlying file came up short, e.g. because it was
+        # truncated since being stat-ed: pad it out.
+        shortfall = max_readable - lenret
+        self.pos += shortfall
+
+        if lenret == 0:
+            return _zeros(shortfall)
+        else:
+            return ret + _zeros(shortfall)
 
     def close(self):
         return self.underlying_fp.close()
@@ -154,12 +194,26 @@ PARTITION_MAX_SZ = 1610612736
 # 262144 is 256 KiB.
 PARTITION_MAX_MEMBERS = int(PARTITION_MAX_SZ / 262144)
 
+# Tunables for stat-ing file paths ahead of segmentation.
+#
+# File metadata on network file systems can take milliseconds per
+# lstat to fetch, so it is done for a batch of paths at a time by a
+# pool of threads, where the round trips overlap.  Each thread is
+# handed a chunk of the batch rather than a path at a time, to keep
+# dispatch overhead small on local disks where lstat is cheap.
+STAT_PREFETCH_THREADS = 16
+STAT_PREFETCH_BATCH = 4096
+
 
 def _fsync_files(filenames):
     """Call fsync() a list of file names
 
     The filenames should be absolute paths already.
 
+    Once synced, the pages of the files are clean, so ask the kernel
+    to drop them: otherwise a large restore can evict everything else
+    in the page cache with data that will not be read again soon.
+
     """
     touched_directories = set()
 
@@ -172,6 +226,7 @@ def _fsync_files(filenames):
     for filename in filenames:
         fd = os.open(filename, mode)
         os.fsync(fd)
+        files.fadvise(fd, 'POSIX_FADV_DONTNEED')
         os.close(fd)
         touched_directories.add(os.path.dirname(filename))
 
@@ -228,8 +283,54 @@ def cat_extract(tar, member, targetpath):
     tar.utime(member, targetpath)
 
 
+def _copy_member_data(out, fileobj, size):
+    """Copy size bytes of member data from fileobj into a tar output
+
+    When a padded file is being written to a pipe, most of the data
+    can be moved by the kernel with sendfile(2), skipping the copy
+    into and out of Python.  What sendfile leaves over, such as
+    padding for a file that shrank, goes through copyfileobj.
+
+    """
+    if isinstance(fileobj, StreamPadFileObj) and hasattr(out, 'sendfile'):
+        raw_file = fileobj.underlying_fp
+        sent = out.sendfile(raw_file.fileno(), fileobj.pos, size)
+        raw_file.seek(fileobj.pos + sent)
+        fileobj.pos += sent
+        size -= sent
+
+    copyfileobj.copyfileobj(fileobj, out, size)
+
+
+def _fast_addfile(tar, tarinfo, fileobj=None):
+    """Add a member to a TarFile opened for writing
+
+    Mostly adapted from tarfile.py's TarFile.addfile, but the member
+    data is moved in PIPE_BUF_BYTES sized blocks, and neither is the
+    TarInfo copied nor is it retained in tar.members, which otherwise
+    grows for the life of a streaming TarFile for no benefit.
+
+    """
+    buf = tarinfo.tobuf(tar.format, tar.encoding, tar.errors)
+    tar.fileobj.write(buf)
+    tar.offset += len(buf)
+
+    # If there's data to follow, append it.
+    if fileobj is not None:
+        _copy_member_data(tar.fileobj, fileobj, tarinfo.size)
+        blocks, remainder = divmod(tarinfo.size, tarfile.BLOCKSIZE)
+        if remainder > 0:
+            tar.fileobj.write(tarfile.NUL * (tarfile.BLOCKSIZE - remainder))
+            blocks += 1
+        tar.offset += blocks * tarfile.BLOCKSIZE
+
+
 class TarPartition(list):
 
+    # Avoid giving every partition its own __dict__ just to hold the
+    # name, in the same spirit as StreamPadFileObj.
+    __slots__ = ('name',)
+
     def __init__(self, name, *args, **kwargs):
         self.name = name
         list.__init__(self, *args, **kwargs)
@@ -237,10 +338,29 @@ class TarPartition(list):
     @staticmethod
     def _padded_tar_add(tar, et_info):
         try:
-            with open(et_info.submitted_path, 'rb') as raw_file:
+            if not et_info.tarinfo.size:
+                # Empty files, of which clusters have many, have no
+                # data to copy: spare opening them, but still skip
+                # those unlinked since being stat-ed.
+                os.lstat(et_info.submitted_path)
+                _fast_addfile(tar, et_info.tarinfo)
+                return
+
+            # Buffer reads in PIPE_BUF_BYTES, the size data is copied
+            # into the tar stream in, rather than the 8 KiB default.
+            # This costs one such buffer per concurrently written
+            # partition, i.e. per --pool-size.
+            with open(et_info.submitted_path, 'rb',
+                      buffering=pipebuf.PIPE_BUF_BYTES) as raw_file:
+                # Files are read exactly once, front to back: ask for
+                # aggressive readahead, and then to drop the pages
+                # afterwards so they do not evict ones hot in
+                # Postgres's working set.
+                files.fadvise(raw_file.fileno(), 'POSIX_FADV_SEQUENTIAL')
                 with StreamPadFileObj(raw_file,
                                       et_info.tarinfo.size) as f:
-                    tar.addfile(et_info.tarinfo, f)
+                    _fast_addfile(tar, et_info.tarinfo, f)
+                    files.fadvise(raw_file.fileno(), 'POSIX_FADV_DONTNEED')
 
         except EnvironmentError as e:
             if (e.errno == errno.ENOENT and
@@ -268,6 +388,11 @@ class TarPartition(list):
         tar = tarfile.open(mode='r|', fileobj=fileobj,
                            bufsize=pipebuf.PIPE_BUF_BYTES)
 
+        # Copy members out in large blocks even when tarfile's
+        # copyfileobj has not been monkey-patched; tarfile's default
+        # is 16 KiB.
+        tar.copybufsize = pipebuf.PIPE_BUF_BYTES
+
         # canonicalize dest_path so the prefix check below works
         dest_path = os.path.realpath(dest_path)
 
@@ -314,8 +439,17 @@ class TarPartition(list):
     def tarfile_write(self, fileobj):
         tar = None
         try:
-            tar = tarfile.open(fileobj=fileobj, mode='w|',
-                               bufsize=pipebuf.PIPE_BUF_BYTES)
+            # Write straight to fileobj rather than in the streaming
+            # mode 'w|': that only adds tarfile's own buffering layer
+            # and copying atop the one fileobj already has, and none
+            # of the seeking that the plain mode permits is done.
+            #
+            # The format is pinned to GNU, tarfile's default before
+            # Python 3.8.  The newer PAX default emits an extended
+            # header for every fractional mtime, tripling header size
+            # and doubling the time spent encoding them.
+            tar = tarfile.open(fileobj=fileobj, mode='w',
+                               format=tarfile.GNU_FORMAT)
 
             for et_info in self:
                 # Treat files specially because they may grow, shrink,
@@ -323,7 +457,7 @@ class TarPartition(list):
                 if et_info.tarinfo.isfile():
                     self._padded_tar_add(tar, et_info)
                 else:
-                    tar.addfile(et_info.tarinfo)
+                    _fast_addfile(tar, et_info.tarinfo)
         finally:
             if tar is not None:
                 tar.close()
@@ -339,13 +473,156 @@ class TarPartition(list):
         return sum(et_info.tarinfo.size for et_info in self)
 
     def format_manifest(self):
-        parts = []
-        for tpart in self:
-            for et_info in tpart:
-                tarinfo = et_info.tarinfo
-                parts.append('\t'.join([tarinfo.name, tarinfo.size]))
+        """
+        Render the name and size of every member, one per line
+
+        Fields are tab-separated.
+
+        """
+        return '\n'.join('{0}\t{1}'.format(et_info.tarinfo.name,
+                                            et_info.tarinfo.size)
+                         for et_info in self)
 
-        return '\n'.join(parts)
+
+def _lstat_all(file_paths):
+    results = []
+    for file_path in file_paths:
+        try:
+            results.append(os.lstat(file_path))
+        except EnvironmentError as e:
+            results.append(e)
+
+    return results
+
+
+def _lstat_stream(file_paths):
+    """Yield (file path, lstat result) pairs, in order of file_paths
+
+    The lstat calls are made concurrently on a pool of threads.  Should
+    lstat fail, the EnvironmentError it raised is yielded in place of
+    its result.
+
+    """
+    it = iter(file_paths)
+    chunk_size = max(1, STAT_PREFETCH_BATCH // STAT_PREFETCH_THREADS)
+    pool = gevent.threadpool.ThreadPool(STAT_PREFETCH_THREADS)
+
+    try:
+        while True:
+            batch = list(itertools.islice(it, STAT_PREFETCH_BATCH))
+            if not batch:
+                break
+
+            chunks = pool.map(_lstat_all,
+                              [batch[i:i + chunk_size]
+                               for i in range(0, len(batch), chunk_size)])
+
+            for file_path, statres in zip(batch,
+                                          itertools.chain(*chunks)):
+                yield file_path, statres
+    finally:
+        pool.kill()
+
+
+class _TarInfoFactory(object):
+    """Build TarInfo values from already-fetched lstat results
+
+    Mostly adapted from tarfile.py's TarFile.gettarinfo, as though
+    called on a TarFile that does not dereference symlinks.  Unlike
+    gettarinfo, the (usually one or two distinct) user and group names
+    are looked up only once each, rather than once per member.
+
+    """
+
+    def __init__(self):
+        # Hard link tracking: (st_ino, st_dev) => first arcname seen.
+        self.inodes = {}
+        self.unames = {}
+        self.gnames = {}
+
+    def _uname(self, uid):
+        try:
+            return self.unames[uid]
+        except KeyError:
+            pass
+
+        uname = ''
+        if pwd is not None:
+            try:
+                uname = pwd.getpwuid(uid)[0]
+            except KeyError:
+                pass
+
+        self.unames[uid] = uname
+        return uname
+
+    def _gname(self, gid):
+        try:
+            return self.gnames[gid]
+        except KeyError:
+            pass
+
+        gname = ''
+        if grp is not None:
+            try:
+                gname = grp.getgrgid(gid)[0]
+            except KeyError:
+                pass
+
+        self.gnames[gid] = gname
+        return gname
+
+    def __call__(self, name, arcname, statres):
+        """Return a TarInfo for name, or None if it cannot be archived"""
+        arcname = arcname.replace(os.sep, '/').lstrip('/')
+        linkname = ''
+
+        stmd = statres.st_mode
+        if stat.S_ISREG(stmd):
+            inode = (statres.st_ino, statres.st_dev)
+            if (statres.st_nlink > 1 and inode in self.inodes and
+                    arcname != self.inodes[inode]):
+                # Is it a hardlink to an already archived file?
+                type = tarfile.LNKTYPE
+                linkname = self.inodes[inode]
+            else:
+                # The inode is added only if its valid.
+                type = tarfile.REGTYPE
+                if inode[0]:
+                    self.inodes[inode] = arcname
+        elif stat.S_ISDIR(stmd):
+            type = tarfile.DIRTYPE
+        elif stat.S_ISFIFO(stmd):
+            type = tarfile.FIFOTYPE
+        elif stat.S_ISLNK(stmd):
+            type = tarfile.SYMTYPE
+            linkname = os.readlink(name)
+        elif stat.S_ISCHR(stmd):
+            type = tarfile.CHRTYPE
+        elif stat.S_ISBLK(stmd):
+            type = tarfile.BLKTYPE
+        else:
+            return None
+
+        tarinfo = tarfile.TarInfo(arcname)
+        tarinfo.mode = stmd
+        tarinfo.uid = statres.st_uid
+        tarinfo.gid = statres.st_gid
+        if type == tarfile.REGTYPE:
+            tarinfo.size = statres.st_size
+        else:
+            tarinfo.size = 0
+        tarinfo.mtime = statres.st_mtime
+        tarinfo.type = type
+        tarinfo.linkname = linkname
+        tarinfo.uname = self._uname(statres.st_uid)
+        tarinfo.gname = self._gname(statres.st_gid)
+
+        if type in (tarfile.CHRTYPE, tarfile.BLKTYPE):
+            tarinfo.devmajor = os.major(statres.st_rdev)
+            tarinfo.devminor = os.minor(statres.st_rdev)
+
+        return tarinfo
 
 
 def _segmentation_guts(root, file_paths, max_partition_size):
@@ -362,82 +639,80 @@ def _segmentation_guts(root, file_paths, max_partition_size):
     if not os.path.isdir(root):
         raise TarBadRootError(root=root)
 
-    bogus_tar = None
+    # Hoisted out of the loop below, which can run for every one of
+    # hundreds of thousands of files.
+    root_len = len(root)
 
-    try:
-        # Create a bogus TarFile as a contrivance to be able to run
-        # gettarinfo and produce such instances.  Some of the settings
-        # on the TarFile are important, like whether to de-reference
-        # symlinks.
-        bogus_tar = tarfile.TarFile(os.devnull, 'w', dereference=False)
-
-        # Bookkeeping for segmentation of tar members into partitions.
-        partition_number = 0
-        partition_bytes = 0
-        partition_members = 0
-        partition = TarPartition(partition_number)
-
-        for file_path in file_paths:
-
-            # Ensure tar members exist within a shared root before
-            # continuing.
-            if not file_path.startswith(root):
-                raise TarBadPathError(root=root, offensive_path=file_path)
-
-            # Create an ExtendedTarInfo to represent the tarfile.
-            try:
-                et_info = ExtendedTarInfo(
-                    tarinfo=bogus_tar.gettarinfo(
-                        file_path, arcname=file_path[len(root):]),
-                    submitted_path=file_path)
-
-            except EnvironmentError as e:
-                if (e.errno == errno.ENOENT and
-                    e.filename == file_path):
-                    # log a NOTICE/INFO that the file was unlinked.
-                    # Ostensibly harmless (such unlinks should be replayed
-                    # in the WAL) but good to know.
-                    logger.debug(
-                        msg='tar member additions skipping an unlinked file',
-                        detail='Skipping {0}.'.format(et_info.submitted_path))
-                    continue
-                else:
-                    raise
-
-            # Ensure tar members are within an expected size before
-            # continuing.
-            if et_info.tarinfo.size > max_partition_size:
-                raise TarMemberTooBigError(
-                    et_info.tarinfo.name, max_partition_size,
-                    et_info.tarinfo.size)
-
-            if (partition_bytes + et_info.tarinfo.size >= max_partition_size
-                or partition_members >= PARTITION_MAX_MEMBERS):
-                # Partition is full and cannot accept another member,
-                # so yield the complete one to the caller.
-                yield partition
-
-                # Prepare a fresh partition to accrue additional file
-                # paths into.
-                partition_number += 1
-                partition_bytes = et_info.tarinfo.size
-                partition_members = 1
-                partition = TarPartition(
-                    partition_number, [et_info])
-            else:
-                # Partition is able to accept this member, so just add
-                # it and increment the size counters.
-                partition_bytes += et_info.tarinfo.size
-                partition_members += 1
-                partition.append(et_info)
+    gettarinfo = _TarInfoFactory()
 
-                # Partition size overflow must not to be possible
-                # here.
-                assert partition_bytes < max_partition_size
+    # Bookkeeping for segmentation of tar members into partitions.
+    partition_number = 0
+    partition_bytes = 0
+    partition_members = 0
+    partition = TarPartition(partition_number)
 
-    finally:
-        if bogus_tar is not None:
-            bogus_tar.close()
+    for file_path, statres in _lstat_stream(file_paths):
+
+        # Ensure tar members exist within a shared root before
+        # continuing.
+        if not file_path.startswith(root):
+            raise TarBadPathError(root=root, offensive_path=file_path)
+
+        # Create an ExtendedTarInfo to represent the tarfile.
+        try:
+            if isinstance(statres, EnvironmentError):
+                raise statres
+
+            tarinfo = gettarinfo(file_path, file_path[root_len:], statres)
+        except EnvironmentError as e:
+            if (e.errno == errno.ENOENT and
+                e.filename == file_path):
+                # log a NOTICE/INFO that the file was unlinked.
+                # Ostensibly harmless (such unlinks should be replayed
+                # in the WAL) but good to know.
+                logger.debug(
+                    msg='tar member additions skipping an unlinked file',
+                    detail='Skipping {0}.'.format(file_path))
+                continue
+            else:
+                raise
+
+        if tarinfo is None:
+            # Sockets and the like cannot be archived.
+            continue
+
+        et_info = ExtendedTarInfo(tarinfo=tarinfo, submitted_path=file_path)
+
+        # Ensure tar members are within an expected size before
+        # continuing.
+        if et_info.tarinfo.size > max_partition_size:
+            raise TarMemberTooBigError(
+                et_info.tarinfo.name, max_partition_size,
+                et_info.tarinfo.size)
+
+        if (partition_bytes + et_info.tarinfo.size >= max_partition_size
+            or partition_members >= PARTITION_MAX_MEMBERS):
+            # Partition is full and cannot accept another member,
+            # so yield the complete one to the caller.
+            yield partition
+
+            # Prepare a fresh partition to accrue additional file
+            # paths into.
+            partition_number += 1
+            partition_bytes = et_info.tarinfo.size
+            partition_members = 1
+            partition = TarPartition(
+                partition_number, [et_info])
+        else:
+            # Partition is able to accept this member, so just add
+            # it and increment the size counters.
+            partition_bytes += et_info.tarinfo.size
+            partition_members += 1
+            partition.append(et_info)
+
+            # Partition size overflow must not to be possible
+            # here.
+            assert partition_bytes < max_partition_size
 
     # Flush out the final partition should it be non-empty.
     if partition:
@@ -450,28 +725,26 @@ def do_not_descend(root, name, dirnames, matches):
         matches.append(os.path.join(root, name))
 
 
-def partition(pg_cluster_dir):
+def _walk_cluster(pg_cluster_dir, spec):
+    """Yield the paths to archive as the cluster directory is walked
+
+    Tablespaces are recorded in spec as they are found, so spec is
+    only complete once every path has been yielded.
+
+    """
     def raise_walk_error(e):
         raise e
-    if not pg_cluster_dir.endswith(os.path.sep):
-        pg_cluster_dir += os.path.sep
-
-    # Accumulates a list of archived files while walking the file
-    # system.
-    matches = []
-    # Maintain a manifest of archived files. Tra
-    spec = {'base_prefix': pg_cluster_dir,
-            'tablespaces': []}
 
+    # The walk yields pg_cluster_dir itself as the first root, verbatim,
+    # so comparing roots to it needs no path normalization.
     walker = os.walk(pg_cluster_dir, onerror=raise_walk_error)
     for root, dirnames, filenames in walker:
-        is_cluster_toplevel = (os.path.abspath(root) ==
-                               os.path.abspath(pg_cluster_dir))
+        is_cluster_toplevel = root == pg_cluster_dir
 
         # Append "root" so the directory is created during restore
         # even if PostgreSQL empties the directory before tar and
         # upload completes.
-        matches.append(root)
+        matches = [root]
 
         if is_cluster_toplevel:
             for name in ['pg_xlog', 'pg_log', 'pg_replslot', 'pg_wal']:
@@ -506,6 +779,9 @@ def partition(pg_cluster_dir):
             else:
                 matches.append(os.path.join(root, filename))
 
+        for match in matches:
+            yield match
+
         # Special case for tablespaces
         if root == os.path.join(pg_cluster_dir, 'pg_tblspc'):
             for tablespace in dirnames:
@@ -530,30 +806,40 @@ def partition(pg_cluster_dir):
                     for ts_root, ts_dirnames, ts_filenames in ts_walker:
                         if 'pgsql_tmp' in ts_dirnames:
                             ts_dirnames.remove('pgsql_tmp')
-                            matches.append(os.path.join(ts_root, 'pgsql_tmp'))
+                            yield os.path.join(ts_root, 'pgsql_tmp')
 
                         for ts_filename in ts_filenames:
-                            matches.append(os.path.join(ts_root, ts_filename))
-
-                        # pick up the empty directories, make sure ts_root
-                        # isn't duplicated
-                        if not ts_filenames and ts_root not in matches:
-                            matches.append(ts_root)
-
-                    # The symlink for this tablespace is now in the match list,
-                    # remove it.
-                    if ts_path in matches:
-                        matches.remove(ts_path)
-
-    # Absolute upload paths are used for telling lzop what to compress. We
-    # must evaluate tablespace storage dirs separately from core file to handle
-    # the case where a common prefix does not exist between the two.
-    local_abspaths = [os.path.abspath(match) for match in matches]
-    # Common local prefix is the prefix removed from the path all tar members.
-    # Core files first
-    local_prefix = os.path.commonprefix(local_abspaths)
-    if not local_prefix.endswith(os.path.sep):
-        local_prefix += os.path.sep
+                            yield os.path.join(ts_root, ts_filename)
+
+                        # Pick up the empty directories, except for the
+                        # tablespace's own: it is restored as a symlink
+                        # from the spec, not as a directory.
+                        if not ts_filenames and ts_root != ts_path:
+                            yield ts_root
+
+
+def partition(pg_cluster_dir):
+    if not pg_cluster_dir.endswith(os.path.sep):
+        pg_cluster_dir += os.path.sep
+
+    # Maintain a manifest of archived files. Tra
+    spec = {'base_prefix': pg_cluster_dir,
+            'tablespaces': []}
+
+    # The cluster is walked as the partitions are consumed, rather than
+    # in full beforehand, so the first partitions can be uploaded
+    # while the rest of the cluster is still being walked.  In turn,
+    # the spec is complete only once all partitions have been
+    # consumed.
+    matches = _walk_cluster(pg_cluster_dir, spec)
+
+    # Common local prefix is the prefix removed from the path all tar
+    # members.  Every match, including those in tablespaces (which are
+    # reached through their pg_tblspc symlinks), lies within the
+    # cluster directory, and the cluster directory itself is a match,
+    # so the prefix is known without scanning all the paths.
+    local_prefix = (os.path.abspath(pg_cluster_dir).rstrip(os.path.sep) +
+                    os.path.sep)
 
     parts = _segmentation_guts(
         local_prefix, matches, PARTITION_MAX_SZ)
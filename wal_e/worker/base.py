@@ -233,6 +233,12 @@ class _DeleteFromContext(object):
         version_depth = base_backup_sentinel_depth + 1
         volume_backup_depth = version_depth + 1
 
+        # Compile the patterns once rather than looking them up in
+        # re's cache for every key.
+        match_sentinel = re.compile(
+            storage.COMPLETE_BASE_BACKUP_REGEXP).match
+        match_base_backup = re.compile(storage.BASE_BACKUP_REGEXP).match
+
         # The base-backup sweep, deleting bulk data and metadata, but
         # not any wal files.
         for key in self._backup_list(prefix=self.layout.basebackups()):
@@ -258,8 +264,7 @@ class _DeleteFromContext(object):
             elif key_depth == base_backup_sentinel_depth:
                 # This is a key at the base-backup-sentinel file
                 # depth, so check to see if it matches the known form.
-                match = re.match(storage.COMPLETE_BASE_BACKUP_REGEXP,
-                                 key_parts[-1])
+                match = match_sentinel(key_parts[-1])
                 if match is None:
                     # This key was at the level for a base backup
                     # sentinel, but doesn't match the known pattern.
@@ -282,8 +287,7 @@ class _DeleteFromContext(object):
                     self._delete_if_before(segment_info, scanned_sn, key,
                                         'a base backup sentinel file')
             elif key_depth == version_depth:
-                match = re.match(
-                    storage.BASE_BACKUP_REGEXP, key_parts[-2])
+                match = match_base_backup(key_parts[-2])
 
                 if match is None or key_parts[-1] != 'extended_version.txt':
                     logger.warning(
@@ -306,8 +310,7 @@ class _DeleteFromContext(object):
                 assert len(key_parts) >= 2, ('must be a logical result of the '
                                              's3 storage layout')
 
-                match = re.match(
-                    storage.BASE_BACKUP_REGEXP, key_parts[-3])
+                match = match_base_backup(key_parts[-3])
 
                 if match is None or key_parts[-2] != 'tar_partitions':
                     logger.warning(
@@ -333,6 +336,14 @@ class _DeleteFromContext(object):
         Doesn't delete any base-backup data.
         """
         wal_key_depth = self.layout.wal_directory().count('/') + 1
+
+        # Compile the patterns once: the WAL directory can hold
+        # millions of keys.
+        match_segment = re.compile(storage.SEGMENT_REGEXP + r'\.lzo').match
+        match_label = re.compile(storage.SEGMENT_REGEXP +
+                                 r'\.[A-F0-9]{8,8}\.backup\.lzo').match
+        match_history = re.compile(r'[A-F0-9]{8,8}\.history').match
+
         for key in self._backup_list(prefix=self.layout.wal_directory()):
             key_name = self.layout.key_name(key)
             bucket = self._container_name(key)
@@ -349,13 +360,9 @@ class _DeleteFromContext(object):
                         'at an unexpected depth.'.format(url)),
                     hint=generic_weird_key_hint_message)
             elif key_depth == wal_key_depth:
-                segment_match = (re.match(storage.SEGMENT_REGEXP + r'\.lzo',
-                                          key_parts[-1]))
-                label_match = (re.match(storage.SEGMENT_REGEXP +
-                                        r'\.[A-F0-9]{8,8}.backup.lzo',
-                                        key_parts[-1]))
-                history_match = re.match(r'[A-F0-9]{8,8}\.history',
-                                         key_parts[-1])
+                segment_match = match_segment(key_parts[-1])
+                label_match = match_label(key_parts[-1])
+                history_match = match_history(key_parts[-1])
 
                 all_matches = [segment_match, label_match, history_match]
 
@@ -439,6 +446,7 @@ class _DeleteFromContext(object):
 
         """
         base_backup_sentinel_depth = self.layout.basebackups().count('/') + 1
+        match_sentinel = re.compile(storage.COMPLETE_BASE_BACKUP_REGEXP).match
 
         # Sweep over base backup files, collecting sentinel files from
         # completed backups.
@@ -456,8 +464,7 @@ class _DeleteFromContext(object):
             if key_depth == base_backup_sentinel_depth:
                 # This is a key at the depth of a base-backup-sentinel file.
                 # Check to see if it matches the known form.
-                match = re.match(storage.COMPLETE_BASE_BACKUP_REGEXP,
-                                 key_parts[-1])
+                match = match_sentinel(key_parts[-1])
 
                 # If this isn't a base-backup-sentinel file, just ignore it.
                 if match is None:
@@ -1,5 +1,6 @@
 import csv
 import datetime
+import io
 import os
 
 from subprocess import PIPE
@@ -58,7 +59,7 @@ def psql_csv_run(sql_command, error_handler=None):
             assert error_handler is None
             raise UserException(
                 'could not csv-execute a query successfully via psql',
-                'Query was "{query}".'.format(sql_command),
+                'Query was "{query}".'.format(query=sql_command),
                 'You may have to set some libpq environment '
                 'variables if you are sure the server is running.')
 
@@ -66,9 +67,10 @@ def psql_csv_run(sql_command, error_handler=None):
     # exit codes
     assert psql_proc.returncode == 0
 
-    # Fake enough iterator interface to get a CSV Reader object
-    # that works.
-    return csv.reader(iter(stdout.strip().split('\n')))
+    # Parse the output in place rather than splitting it into a list
+    # of lines first, which also keeps quoted fields containing
+    # newlines intact.
+    return csv.reader(io.StringIO(stdout, newline=''))
 
 
 class PgBackupStatements(object):
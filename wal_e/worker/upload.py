@@ -1,12 +1,9 @@
 import errno
-import socket
 import tempfile
 import time
 
-try:
-    import boto.exception
-except ImportError:
-    boto = None
+import gevent
+import gevent.lock
 
 from wal_e import log_help
 from wal_e import pipebuf
@@ -14,24 +11,31 @@ from wal_e import pipeline
 from wal_e import storage
 from wal_e.blobstore import get_blobstore
 from wal_e.piper import PIPE
-from wal_e.retries import retry, retry_with_count
-from wal_e.worker.worker_util import do_lzop_put, format_kib_per_second
+from wal_e.retries import (log_send_failures_on_error, retry,
+                           retry_with_count)
+from wal_e.worker.worker_util import (do_lzop_put, format_kib_per_second,
+                                      wal_spool_bytes)
 
 logger = log_help.WalELogger(__name__)
 
 
 class WalUploader(object):
-    def __init__(self, layout, creds, gpg_key_id):
+    def __init__(self, layout, creds, gpg_key_id, concurrency=1):
         self.layout = layout
         self.creds = creds
         self.gpg_key_id = gpg_key_id
         self.blobstore = get_blobstore(layout)
 
-    def __call__(self, segment):
+        # Segments being uploaded at once share a fixed memory budget
+        # for their compressed output.
+        self.spool_bytes = wal_spool_bytes(concurrency)
+
         # TODO :: Move arbitrary path construction to StorageLayout Object
-        url = '{0}/wal_{1}/{2}.lzo'.format(self.layout.prefix.rstrip('/'),
-                                           storage.CURRENT_VERSION,
-                                           segment.name)
+        self.url_prefix = '{0}/wal_{1}/'.format(layout.prefix.rstrip('/'),
+                                                storage.CURRENT_VERSION)
+
+    def __call__(self, segment):
+        url = self.url_prefix + segment.name + '.lzo'
 
         logger.info(msg='begin archiving a file',
                     detail=('Uploading "{wal_path}" to "{url}".'
@@ -50,7 +54,8 @@ class WalUploader(object):
         try:
             # Upload and record the rate at which it happened.
             kib_per_second = do_lzop_put(self.creds, url, segment.path,
-                                         self.gpg_key_id)
+                                         self.gpg_key_id,
+                                         spool_bytes=self.spool_bytes)
         except EnvironmentError as e:
             if not segment.explicit and e.errno == errno.ENOENT:
                 structured = dict(state='skip', **structured_template)
@@ -73,97 +78,137 @@ class WalUploader(object):
         return segment
 
 
+def _slots(concurrency):
+    if concurrency is None:
+        return gevent.lock.DummySemaphore()
+    else:
+        return gevent.lock.BoundedSemaphore(concurrency)
+
+
 class PartitionUploader(object):
-    def __init__(self, creds, backup_prefix, rate_limit, gpg_key):
+    def __init__(self, creds, backup_prefix, rate_limit, gpg_key,
+                 compression_concurrency=None, upload_concurrency=None):
         self.creds = creds
         self.backup_prefix = backup_prefix
         self.rate_limit = rate_limit
         self.gpg_key = gpg_key
         self.blobstore = get_blobstore(storage.StorageLayout(backup_prefix))
 
+        # Compression (disk and CPU bound) and uploading (network
+        # bound) are limited separately, so that a partition that
+        # has finished compressing can wait for its upload while
+        # another partition is being compressed.
+        self.compression_slots = _slots(compression_concurrency)
+        self.upload_slots = _slots(upload_concurrency)
+
     def __call__(self, tpart):
         """
         Synchronous version of the upload wrapper
 
         """
-        logger.info(msg='beginning volume compression',
-                    detail='Building volume {name}.'.format(name=tpart.name))
+        # Stores that can take uploads of unknown length are fed
+        # directly from the compression pipeline, with no temporary
+        # file in between.  Such a partition is compressing and
+        # uploading at the same time, so it occupies a slot of each.
+        put_stream = getattr(self.blobstore, 'uri_put_stream', None)
+        if put_stream is not None:
+            with self.compression_slots, self.upload_slots:
+                self._stream(tpart, put_stream)
+
+            return tpart
 
         with tempfile.NamedTemporaryFile(
                 mode='r+b', buffering=pipebuf.PIPE_BUF_BYTES) as tf:
-            with pipeline.get_upload_pipeline(PIPE, tf,
-                                              rate_limit=self.rate_limit,
-                                              gpg_key=self.gpg_key) as pl:
-                tpart.tarfile_write(pl.stdin)
-
-            tf.flush()
-
-            # TODO :: Move arbitrary path construction to StorageLayout Object
-            url = '{0}/tar_partitions/part_{number:08d}.tar.lzo'.format(
-                self.backup_prefix.rstrip('/'), number=tpart.name)
-
-            logger.info(msg='begin uploading a base backup volume',
-                        detail='Uploading to "{url}".'.format(url=url))
-
-            def log_volume_failures_on_error(exc_tup, exc_processor_cxt):
-                def standard_detail_message(prefix=''):
-                    return (prefix +
-                            '  There have been {n} attempts to send the '
-                            'volume {name} so far.'.format(n=exc_processor_cxt,
-                                                           name=tpart.name))
-
-                typ, value, tb = exc_tup
-                del exc_tup
-
-                # Screen for certain kinds of known-errors to retry from
-                if issubclass(typ, socket.error):
-                    socketmsg = value[1] if isinstance(value, tuple) else value
-
-                    logger.info(
-                        msg='Retrying send because of a socket error',
-                        detail=standard_detail_message(
-                            "The socket error's message is '{0}'."
-                            .format(socketmsg)))
-                elif is_s3_response_error(typ, value):
-                    logger.info(
-                        msg='Retrying send because of a Request Skew time',
-                        detail=standard_detail_message())
-                else:
-                    # This type of error is unrecognized as a retry-able
-                    # condition, so propagate it, original stacktrace and
-                    # all.
-                    raise typ(value).with_traceback(tb)
-
-            @retry(retry_with_count(log_volume_failures_on_error))
-            def put_file_helper():
-                tf.seek(0)
-                return self.blobstore.uri_put_file(self.creds, url, tf)
-
-            # Actually do work, retrying if necessary, and timing how long
-            # it takes.
-            clock_start = time.time()
-            k = put_file_helper()
-            clock_finish = time.time()
-
-            kib_per_second = format_kib_per_second(clock_start, clock_finish,
-                                                   k.size)
-            logger.info(
-                msg='finish uploading a base backup volume',
-                detail=('Uploading to "{url}" complete at '
-                        '{kib_per_second}KiB/s. '
-                        .format(url=url, kib_per_second=kib_per_second)))
+            with self.compression_slots:
+                self._compress(tpart, tf)
+
+            with self.upload_slots:
+                self._upload(tpart, tf)
 
         return tpart
 
+    def _url(self, tpart):
+        # TODO :: Move arbitrary path construction to StorageLayout Object
+        return '{0}/tar_partitions/part_{number:08d}.tar.lzo'.format(
+            self.backup_prefix.rstrip('/'), number=tpart.name)
+
+    def _stream(self, tpart, put_stream):
+        url = self._url(tpart)
+
+        logger.info(msg='begin compressing and uploading a base backup '
+                    'volume',
+                    detail=('Building volume {name} and uploading to "{url}".'
+                            .format(name=tpart.name, url=url)))
+
+        def write_tar(stdin):
+            tpart.tarfile_write(stdin)
+            stdin.flush()
+            stdin.close()
+
+        clock_start = time.time()
+
+        with pipeline.get_upload_pipeline(PIPE, PIPE,
+                                          rate_limit=self.rate_limit,
+                                          gpg_key=self.gpg_key) as pl:
+            writer = gevent.spawn(write_tar, pl.stdin)
+            sender = gevent.spawn(put_stream, self.creds, url, pl.stdout)
+
+            try:
+                # Stop at the first failure of either side: the other
+                # could otherwise wait on it forever.
+                gevent.joinall([writer, sender], raise_error=True)
+            except BaseException:
+                gevent.killall([writer, sender], block=True, timeout=30)
+
+                # Let the compressor exit, rather than block writing
+                # output no one will read.
+                pl.stdout.close()
+                raise
 
-def is_s3_response_error(typ, value):
-    if boto is None:
-        return False
+        k = sender.get()
+        clock_finish = time.time()
 
-    if not issubclass(typ, boto.exception.S3ResponseError):
-        return False
+        kib_per_second = format_kib_per_second(clock_start, clock_finish,
+                                               k.size)
+        logger.info(
+            msg='finish uploading a base backup volume',
+            detail=('Uploading to "{url}" complete at '
+                    '{kib_per_second}KiB/s. '
+                    .format(url=url, kib_per_second=kib_per_second)))
 
-    if not value.error_code == 'RequestTimeTooSkewed':
-        return False
+    def _compress(self, tpart, tf):
+        logger.info(msg='beginning volume compression',
+                    detail='Building volume {name}.'.format(name=tpart.name))
 
-    return True
+        with pipeline.get_upload_pipeline(PIPE, tf,
+                                          rate_limit=self.rate_limit,
+                                          gpg_key=self.gpg_key) as pl:
+            tpart.tarfile_write(pl.stdin)
+
+        tf.flush()
+
+    def _upload(self, tpart, tf):
+        url = self._url(tpart)
+
+        logger.info(msg='begin uploading a base backup volume',
+                    detail='Uploading to "{url}".'.format(url=url))
+
+        @retry(retry_with_count(log_send_failures_on_error(
+            'send the volume {name}'.format(name=tpart.name))))
+        def put_file_helper():
+            tf.seek(0)
+            return self.blobstore.uri_put_file(self.creds, url, tf)
+
+        # Actually do work, retrying if necessary, and timing how long
+        # it takes.
+        clock_start = time.time()
+        k = put_file_helper()
+        clock_finish = time.time()
+
+        kib_per_second = format_kib_per_second(clock_start, clock_finish,
+                                               k.size)
+        logger.info(
+            msg='finish uploading a base backup volume',
+            detail=('Uploading to "{url}" complete at '
+                    '{kib_per_second}KiB/s. '
+                    .format(url=url, kib_per_second=kib_per_second)))
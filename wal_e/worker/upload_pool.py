@@ -26,10 +26,15 @@ class TarUploadPool(object):
         # Used for both synchronization and measurement.
         self.concurrency_burden = 0
 
+        # Running uploads, retained so they can be stopped once any
+        # one of them fails.
+        self.greenlets = set()
+
     def _start(self, tpart):
         """Start upload and accout for resource consumption."""
         g = gevent.Greenlet(self.uploader, tpart)
         g.link(self._finish)
+        self.greenlets.add(g)
 
         # Account for concurrency_burden before starting the greenlet
         # to avoid racing against .join.
@@ -46,6 +51,7 @@ class TarUploadPool(object):
         finished TarPartition value across a channel.
         """
         assert g.ready()
+        self.greenlets.discard(g)
 
         if g.successful():
             finished_tpart = g.get()
@@ -61,7 +67,11 @@ class TarUploadPool(object):
         val = self.wait_change.get()
 
         if isinstance(val, Exception):
-            # Don't other uncharging, because execution is going to stop
+            # Don't bother uncharging, because execution is going to
+            # stop.  The backup has failed, so there is no point in
+            # letting other uploads run to completion: stop them now
+            # rather than after they send what could be gigabytes.
+            self.kill()
             raise val
         else:
             # Uncharge for resources.
@@ -118,3 +128,8 @@ class TarUploadPool(object):
 
         while self.concurrency_burden > 0:
             self._wait()
+
+    def kill(self):
+        """Stop all uploads in progress, for when the backup has failed."""
+        self.closed = True
+        gevent.killall(list(self.greenlets), block=True, timeout=30)
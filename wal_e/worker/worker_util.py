@@ -1,10 +1,25 @@
 import tempfile
 import time
 
-from wal_e import pipebuf
+from wal_e import copyfileobj
+from wal_e import files
 from wal_e import storage
 from wal_e.blobstore import get_blobstore
 from wal_e import pipeline
+from wal_e.piper import PIPE
+
+# Size of a default WAL segment: at most this much compressed output
+# of any one segment is kept in memory.
+WAL_SPOOL_BYTES = 16 * 1024 * 1024
+
+# Memory to spend on spooling all the segments of one wal-push, which
+# can upload several at once (--pool-size).
+WAL_SPOOL_BUDGET_BYTES = 64 * 1024 * 1024
+
+
+def wal_spool_bytes(concurrency):
+    """Size of in-memory spool for each of concurrency WAL uploads"""
+    return min(WAL_SPOOL_BYTES, WAL_SPOOL_BUDGET_BYTES // max(concurrency, 1))
 
 
 def uri_put_file(creds, uri, fp, content_type=None):
@@ -13,7 +28,8 @@ def uri_put_file(creds, uri, fp, content_type=None):
                                   content_type=content_type)
 
 
-def do_lzop_put(creds, url, local_path, gpg_key):
+def do_lzop_put(creds, url, local_path, gpg_key,
+                spool_bytes=WAL_SPOOL_BYTES):
     """
     Compress and upload a given local path.
 
@@ -23,17 +39,28 @@ def do_lzop_put(creds, url, local_path, gpg_key):
     :type local_path: string
     :param local_path: a path to a file to be compressed
 
+    :type spool_bytes: int
+    :param spool_bytes: how much compressed output to hold in memory
+        before spilling to a temporary file
+
     """
     assert url.endswith('.lzo')
     blobstore = get_blobstore(storage.StorageLayout(url))
 
-    with tempfile.NamedTemporaryFile(
-            mode='r+b', buffering=pipebuf.PIPE_BUF_BYTES) as tf:
-        with pipeline.get_upload_pipeline(
-                open(local_path, 'rb'), tf, gpg_key=gpg_key):
-            pass
-
-        tf.flush()
+    # Compressed WAL segments are small enough to be kept in memory
+    # in the common case, sparing a write and read back of the
+    # compressed data through the file system.  Anything unexpectedly
+    # large still spills to disk.
+    with tempfile.SpooledTemporaryFile(max_size=spool_bytes) as tf:
+        with open(local_path, 'rb') as in_f:
+            # The segment is read once, start to finish, and will not
+            # be read again once archived: keep it from displacing
+            # pages Postgres is using.
+            files.fadvise(in_f.fileno(), 'POSIX_FADV_SEQUENTIAL')
+            with pipeline.get_upload_pipeline(
+                    in_f, PIPE, gpg_key=gpg_key) as pl:
+                copyfileobj.copyfileobj(pl.stdout, tf)
+            files.fadvise(in_f.fileno(), 'POSIX_FADV_DONTNEED')
 
         clock_start = time.time()
         tf.seek(0)